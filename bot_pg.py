@@ -1,8 +1,11 @@
 import os
+import io
+import codecs
+import re
 import logging
-import pandas as pd
+from urllib.parse import SplitResult, urlsplit, urlunsplit
 import asyncpg
-import nest_asyncio
+import uvloop
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InputFile
 from telegram.ext import (
@@ -15,9 +18,6 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-# Применяем nest_asyncio для предотвращения проблем с event loop
-nest_asyncio.apply()
-
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -36,9 +36,89 @@ if not TOKEN:
 # Определение состояний
 WAITING_VIDEO_LINKS, WAITING_RATING, WAITING_COMMENT = range(3)
 
-# Подключение к БД
+# Клавиатуры не меняются, поэтому создаются один раз
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎥 Отправить видео", callback_data="send_video")],
+    [InlineKeyboardButton("⭐ Начать оценку", callback_data="start_rating")],
+    [InlineKeyboardButton("ℹ️ Помощь", callback_data="help")],
+])
+LINKS_SAVED_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Ещё видео", callback_data="send_video")],
+    [InlineKeyboardButton("🏠 В меню", callback_data="start")],
+])
+
+# Экспорт CSV: колонки и разделитель
+EXPORT_COLUMNS = ["id", "link", "total_score", "avg_score", "comments"]
+EXPORT_DELIMITER = ";"
+# Экспорт может идти дольше command_timeout пула, поэтому у него свой лимит
+EXPORT_TIMEOUT = 600
+
+# Ключ advisory-блокировки, под которой пересоздаётся таблица videos
+VIDEOS_LOCK_KEY = 42
+# Пересоздание ждёт окончания идущих экспортов, поэтому лимит как у экспорта
+RESET_TIMEOUT = EXPORT_TIMEOUT
+
+# Тексты всех запросов бота в одном месте; при старте кладутся в bot_data
+SQL = {
+    "lock_videos": f"SELECT pg_advisory_xact_lock({VIDEOS_LOCK_KEY})",
+    "drop_videos": "DROP TABLE IF EXISTS videos CASCADE",
+    "create_videos": """CREATE TABLE videos (
+                id SERIAL PRIMARY KEY,
+                link TEXT NOT NULL,
+                total_score INT DEFAULT 0,
+                avg_score FLOAT DEFAULT 0,
+                comments TEXT DEFAULT '[]'
+            )""",
+    "insert_video": "INSERT INTO videos (link) VALUES ($1)",
+    "export_videos": f"SELECT {', '.join(EXPORT_COLUMNS)} FROM videos",
+}
+
+# Сетевая часть ссылки: необязательные данные пользователя до "@", хост
+# хотя бы с одной буквой или цифрой и необязательный порт. Префикс хоста
+# не пересекается с обязательным символом после него, поэтому fullmatch
+# проверяется за линейное время. re.ASCII не используется, чтобы, как и
+# прежняя проверка через isalnum(), принимать буквы не только латиницы
+URL_NETLOC_REGEX = re.compile(r"(?:[\w\-.~:]*@)?[\-.~_]*[^\W_][\w\-.~]*(?::\d*)?")
+
+# Разбор ссылки; None, если urlsplit не смог её разобрать
+def split_url(link: str):
+    try:
+        return urlsplit(link)
+    except ValueError:
+        return None
+
+# Проверка разобранной ссылки: схема и fullmatch по сетевой части
+def is_valid_url(parts: SplitResult) -> bool:
+    return (
+        parts.scheme in ("http", "https")
+        and URL_NETLOC_REGEX.fullmatch(parts.netloc) is not None
+    )
+
+# Приведение ссылки к единому виду, чтобы тривиальные варианты совпадали.
+# Регистр меняется только у схемы и хоста, данные пользователя не трогаются
+def normalize_url(parts: SplitResult) -> str:
+    userinfo, at, host = parts.netloc.rpartition("@")
+    return urlunsplit((
+        parts.scheme.lower(),
+        userinfo + at + host.lower(),
+        parts.path.rstrip("/"),
+        parts.query,
+        parts.fragment,
+    ))
+
+# Подключение к БД. Пул открывает min_size соединений при старте и растёт
+# до max_size под нагрузкой; соединения, простаивающие дольше 5 минут,
+# закрываются. Кэш выражений небольшой, так как различных запросов с
+# параметрами у бота мало; command_timeout ограничивает обычные запросы
 async def get_db_pool():
-    return await asyncpg.create_pool(DATABASE_URL)
+    return await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=5,
+        max_size=25,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=32,
+        command_timeout=10,
+    )
 
 # Пересоздание таблицы
 async def recreate_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -47,18 +127,19 @@ async def recreate_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("❌ База данных недоступна")
         return
 
-    async with db_pool.acquire() as conn:
-        await conn.execute("DROP TABLE IF EXISTS videos CASCADE")
-        await conn.execute(
-            """CREATE TABLE videos (
-                id SERIAL PRIMARY KEY,
-                link TEXT NOT NULL,
-                total_score INT DEFAULT 0,
-                avg_score FLOAT DEFAULT 0,
-                comments TEXT DEFAULT '[]'
-            )"""
-        )
-    await update.effective_message.reply_text("🔄 Таблица пересоздана")
+    sql = context.bot_data["sql"]
+    # Удаление и создание выполняются атомарно, а advisory-блокировка не даёт
+    # двум пересозданиям идти одновременно
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(sql["lock_videos"], timeout=RESET_TIMEOUT)
+                await conn.execute(sql["drop_videos"], timeout=RESET_TIMEOUT)
+                await conn.execute(sql["create_videos"])
+        await update.effective_message.reply_text("🔄 Таблица пересоздана")
+    except Exception as e:
+        logging.error(f"Ошибка: {e}")
+        await update.effective_message.reply_text("🚫 Произошла ошибка")
 
 # Скачивание данных
 async def download(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -67,24 +148,34 @@ async def download(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("❌ База данных недоступна")
         return
 
-    async with db_pool.acquire() as conn:
-        records = await conn.fetch("SELECT * FROM videos")
-        df = pd.DataFrame(records, columns=["id", "link", "total_score", "avg_score", "comments"])
-        df.to_csv("videos.csv", index=False)
-        
-        with open("videos.csv", "rb") as file:
-            await update.effective_message.reply_document(document=InputFile(file, "videos.csv"))
+    # CSV формирует сам PostgreSQL (COPY ... TO STDOUT), а байты сразу
+    # складываются в память: без временного файла, fsync и очистки
+    buf = io.BytesIO()
+    buf.write(codecs.BOM_UTF8)
+
+    async def write_chunk(data: bytes):
+        buf.write(data)
+
+    try:
+        await db_pool.copy_from_query(
+            context.bot_data["sql"]["export_videos"],
+            output=write_chunk,
+            format="csv",
+            header=True,
+            delimiter=EXPORT_DELIMITER,
+            timeout=EXPORT_TIMEOUT,
+        )
+        buf.seek(0)
+        await update.effective_message.reply_document(document=InputFile(buf, filename="videos.csv"))
+    except Exception as e:
+        logging.error(f"Ошибка: {e}")
+        await update.effective_message.reply_text("🚫 Произошла ошибка")
 
 # Обработчики команд
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("🎥 Отправить видео", callback_data="send_video")],
-        [InlineKeyboardButton("⭐ Начать оценку", callback_data="start_rating")],
-        [InlineKeyboardButton("ℹ️ Помощь", callback_data="help")],
-    ]
     await update.effective_message.reply_text(
         "Привет! Выберите действие:",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=MAIN_MENU,
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -107,7 +198,16 @@ async def receive_video_links(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.effective_message.reply_text("❌ Некорректный ввод")
         return ConversationHandler.END
 
-    links = update.message.text.split()
+    tokens = update.message.text.split()
+    parsed = (split_url(link) for link in tokens)
+    valid = [parts for parts in parsed if parts and is_valid_url(parts)]
+    skipped = len(tokens) - len(valid)
+    # Дубликаты убираются до обращения к БД, порядок ссылок сохраняется
+    links = list(dict.fromkeys(normalize_url(parts) for parts in valid))
+    if not links:
+        await update.effective_message.reply_text("❌ Не найдено корректных ссылок")
+        return ConversationHandler.END
+
     db_pool = context.bot_data.get("db_pool")
     
     if not db_pool:
@@ -115,19 +215,20 @@ async def receive_video_links(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
     try:
+        # Все ссылки вставляются одним пакетом в одной транзакции
         async with db_pool.acquire() as conn:
-            for link in links:
-                await conn.execute(
-                    "INSERT INTO videos (link) VALUES ($1)", link.strip()
+            async with conn.transaction():
+                await conn.executemany(
+                    context.bot_data["sql"]["insert_video"],
+                    [(link,) for link in links],
                 )
-        
-        keyboard = [
-            [InlineKeyboardButton("➕ Ещё видео", callback_data="send_video")],
-            [InlineKeyboardButton("🏠 В меню", callback_data="start")],
-        ]
+
+        text = "✅ Ссылки сохранены!"
+        if skipped:
+            text += f"\n⚠️ Пропущено некорректных ссылок: {skipped}"
         await update.effective_message.reply_text(
-            "✅ Ссылки сохранены!",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            text,
+            reply_markup=LINKS_SAVED_MENU,
         )
     except Exception as e:
         logging.error(f"Ошибка: {e}")
@@ -135,9 +236,30 @@ async def receive_video_links(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     return ConversationHandler.END
 
+# Инициализация ресурсов после запуска event loop
+async def on_startup(app: Application):
+    app.bot_data["db_pool"] = await get_db_pool()
+    app.bot_data["sql"] = SQL
+    logging.info("Бот запущен")
+
+# Освобождение ресурсов при остановке бота
+async def on_shutdown(app: Application):
+    db_pool = app.bot_data.get("db_pool")
+    if db_pool:
+        await db_pool.close()
+
 # Настройка приложения
 def main():
-    app = Application.builder().token(TOKEN).build()
+    # uvloop ставится до создания Application, чтобы run_polling
+    # работал на его цикле событий
+    uvloop.install()
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Conversation Handler для отправки видео
     conv_handler = ConversationHandler(
@@ -160,11 +282,7 @@ def main():
     app.add_handler(CallbackQueryHandler(help_command, pattern="^help$"))
 
     # Запуск бота
-    async def on_startup(app: Application):
-        app.bot_data["db_pool"] = await get_db_pool()
-        logging.info("Бот запущен")
-
-    app.run_polling(on_startup=on_startup)
+    app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file